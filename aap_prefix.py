@@ -1,59 +1,67 @@
 import yaml
 import os
 
+# -----------------------------
+# Turn a linked path tuple into "a.b[0].c"
+# -----------------------------
+def format_path(path):
+    parts = []
+    while path is not None:
+        path, part, is_index = path
+        parts.append(f"[{part}]" if is_index else f".{part}")
+    parts.reverse()
+    if parts and parts[0][0] == ".":
+        parts[0] = parts[0][1:]
+    return "".join(parts)
+
 # -----------------------------
 # Recursive prefix function with lookup
 # -----------------------------
-def recursive_prefix_lookup(data, prefix, keys_to_prefix, lookup):
+def recursive_prefix_lookup(data, prefix, keys_to_prefix, lookup, diffs, path=None):
     """
     Recursively traverse YAML data, prepend prefix to specified keys,
-    and record changes in a lookup table.
+    and record changes in a lookup table and as (path, old, new) diffs.
+    The path is a linked (parent, key_or_index, is_index) tuple that is only
+    formatted when a diff is recorded.
     """
     if isinstance(data, dict):
-        new_data = {}
+        # Copy the container only once something under it actually changes
+        new_data = None
         for key, value in data.items():
+            p = (path, key, False)
             if key in keys_to_prefix and isinstance(value, str):
-                if not value.startswith(prefix):
-                    new_value = f"{prefix}{value}"
-                    lookup[value] = new_value
-                    new_data[key] = new_value
-                else:
-                    new_data[key] = value
+                if value.startswith(prefix):
+                    continue
+                new_value = f"{prefix}{value}"
+                lookup[value] = new_value
+                diffs.append((format_path(p), value, new_value))
             else:
-                new_data[key] = recursive_prefix_lookup(value, prefix, keys_to_prefix, lookup)
-        return new_data
+                new_value = recursive_prefix_lookup(value, prefix, keys_to_prefix, lookup, diffs, p)
+                if new_value is value:
+                    continue
+            if new_data is None:
+                new_data = dict(data)
+            new_data[key] = new_value
+        return data if new_data is None else new_data
     elif isinstance(data, list):
-        return [recursive_prefix_lookup(item, prefix, keys_to_prefix, lookup) for item in data]
+        new_data = None
+        for i, item in enumerate(data):
+            new_item = recursive_prefix_lookup(item, prefix, keys_to_prefix, lookup, diffs, (path, i, True))
+            if new_item is not item:
+                if new_data is None:
+                    new_data = list(data)
+                new_data[i] = new_item
+        return data if new_data is None else new_data
     else:
         return data
 
 # -----------------------------
-# Diff function for reporting changes
+# Dumper that writes shared objects out in full instead of as &id/*id
+# aliases; untouched subtrees are no longer copied, so they stay shared
 # -----------------------------
-def diff_dict(d1, d2, path=""):
-    changes = []
-    if isinstance(d1, dict) and isinstance(d2, dict):
-        for k in d1.keys() | d2.keys():
-            p = f"{path}.{k}" if path else k
-            if k in d1 and k in d2:
-                changes.extend(diff_dict(d1[k], d2[k], p))
-            elif k in d1:
-                changes.append((p, d1[k], None))
-            else:
-                changes.append((p, None, d2[k]))
-    elif isinstance(d1, list) and isinstance(d2, list):
-        for i, (v1, v2) in enumerate(zip(d1, d2)):
-            p = f"{path}[{i}]"
-            changes.extend(diff_dict(v1, v2, p))
-        # handle extra items
-        for i in range(len(d1), len(d2)):
-            changes.append((f"{path}[{i}]", None, d2[i]))
-        for i in range(len(d2), len(d1)):
-            changes.append((f"{path}[{i}]", d1[i], None))
-    else:
-        if d1 != d2:
-            changes.append((path, d1, d2))
-    return changes
+class NoAliasSafeDumper(yaml.SafeDumper):
+    def ignore_aliases(self, data):
+        return True
 
 # -----------------------------
 # Process a YAML file
@@ -62,11 +70,11 @@ def process_yaml_file(filepath, prefix, keys_to_prefix, lookup):
     with open(filepath, "r") as f:
         original_data = yaml.safe_load(f)
 
-    updated_data = recursive_prefix_lookup(original_data, prefix, keys_to_prefix, lookup)
-    diffs = diff_dict(original_data, updated_data)
+    diffs = []
+    updated_data = recursive_prefix_lookup(original_data, prefix, keys_to_prefix, lookup, diffs)
 
     with open(filepath, "w") as f:
-        yaml.safe_dump(updated_data, f, sort_keys=False)
+        yaml.dump(updated_data, f, Dumper=NoAliasSafeDumper, sort_keys=False)
 
     print(f"Processed: {os.path.basename(filepath)}")
     if diffs:
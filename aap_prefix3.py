@@ -1,51 +1,196 @@
 import yaml
+import hashlib
+import json
 import os
 import re
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
 
-# Recursive prefix function with lookup
-def recursive_prefix_lookup(data, prefix, keys_to_prefix, lookup):
-    if isinstance(data, dict):
-        new_data = {}
-        for key, value in data.items():
-            if key in keys_to_prefix and isinstance(value, str):
-                if not value.startswith(prefix):
-                    new_value = f"{prefix}{value}"
-                    lookup[value] = new_value
-                    new_data[key] = new_value
-                else:
-                    new_data[key] = value
-            else:
-                new_data[key] = recursive_prefix_lookup(value, prefix, keys_to_prefix, lookup)
-        return new_data
-    elif isinstance(data, list):
-        return [recursive_prefix_lookup(item, prefix, keys_to_prefix, lookup) for item in data]
-    else:
-        return data
-
-# Diff function for reporting changes
-def diff_dict(d1, d2, path=""):
-    changes = []
-    if isinstance(d1, dict) and isinstance(d2, dict):
-        for k in d1.keys() | d2.keys():
-            p = f"{path}.{k}" if path else k
-            if k in d1 and k in d2:
-                changes.extend(diff_dict(d1[k], d2[k], p))
-            elif k in d1:
-                changes.append((p, d1[k], None))
-            else:
-                changes.append((p, None, d2[k]))
-    elif isinstance(d1, list) and isinstance(d2, list):
-        for i, (v1, v2) in enumerate(zip(d1, d2)):
-            p = f"{path}[{i}]"
-            changes.extend(diff_dict(v1, v2, p))
-        for i in range(len(d1), len(d2)):
-            changes.append((f"{path}[{i}]", None, d2[i]))
-        for i in range(len(d2), len(d1)):
-            changes.append((f"{path}[{i}]", d1[i], None))
+try:
+    from yaml import CSafeLoader, CSafeDumper
+except ImportError:
+    from yaml import SafeLoader as CSafeLoader, SafeDumper as CSafeDumper
+
+# Paths are kept as linked (parent, key_or_index, is_index) tuples while
+# walking and only turned into "a.b[0].c" strings when a diff is recorded
+def _format_path(path):
+    parts = []
+    while path is not None:
+        path, part, is_index = path
+        parts.append(f"[{part}]" if is_index else f".{part}")
+    parts.reverse()
+    if parts and parts[0][0] == ".":
+        parts[0] = parts[0][1:]
+    return "".join(parts)
+
+# Stack marker pushed under a container's children; popping it closes
+# the range of diffs recorded beneath that container
+_SPAN_END = object()
+
+# Re-root a linked path recorded under old_base onto new_base
+def _rebase(path, old_base, new_base):
+    parts = []
+    while path is not old_base:
+        path, part, is_index = path
+        parts.append((part, is_index))
+    for part, is_index in reversed(parts):
+        new_base = (new_base, part, is_index)
+    return new_base
+
+# Prefix values in place (iteratively), recording lookup entries and diffs
+def prefix_inplace(root, prefix, keys_to_prefix, lookup, diffs):
+    _str = str; _dict = dict; _list = list; _keys = keys_to_prefix; _intern = sys.intern
+    # A head-slice compare skips startswith()'s method-call overhead
+    prefix = _intern(prefix); plen = len(prefix)
+    # Containers shared via YAML anchors/aliases are walked once; every
+    # node stays alive through root, so id() values are not reused. The
+    # diffs found under a shared container are replayed for each later
+    # path that reaches it: spans maps its id to (path, start, end) over
+    # diff_paths, which holds the linked path of every diff recorded here
+    seen = set()
+    spans = {}
+    diff_paths = []
+    base = len(diffs)
+    stack = [(root, None)]
+    while stack:
+        node, path = stack.pop()
+        if node is _SPAN_END:
+            node_id, node_path, start = path
+            spans[node_id] = (node_path, start, len(diff_paths))
+            continue
+        node_id = id(node)
+        if node_id in seen:
+            # No span yet means a cycle back into a container still being walked
+            span = spans.get(node_id)
+            if span is not None:
+                old_path, start, end = span
+                for n in range(start, end):
+                    new_path = _rebase(diff_paths[n], old_path, path)
+                    _, value, new_value = diffs[base + n]
+                    diffs.append((_format_path(new_path), value, new_value))
+                    diff_paths.append(new_path)
+            continue
+        seen.add(node_id)
+        stack.append((_SPAN_END, (node_id, path, len(diff_paths))))
+        if type(node) is _dict:
+            children = []
+            for key, value in node.items():
+                if key in _keys and type(value) is _str:
+                    if value[:plen] != prefix:
+                        # Reuse (and intern) the prefixed string for repeated names
+                        new_value = lookup.get(value)
+                        if new_value is None:
+                            new_value = _intern(prefix + value)
+                            lookup[value] = new_value
+                        node[key] = new_value
+                        leaf_path = (path, key, False)
+                        diffs.append((_format_path(leaf_path), value, new_value))
+                        diff_paths.append(leaf_path)
+                elif type(value) in (_dict, _list):
+                    children.append((value, (path, key, False)))
+            # Push in reverse so diffs keep document order
+            stack.extend(reversed(children))
+        elif type(node) is _list:
+            children = [(item, (path, i, True)) for i, item in enumerate(node) if type(item) in (_dict, _list)]
+            stack.extend(reversed(children))
+
+# A `|`/`>` is a block header only right after the line's own key separator
+# or a leading `- ` list marker; block-scalar bodies are skipped so text
+# inside them is never rewritten. Returns (owner, content_start) where owner
+# is the column the body must be indented past and content_start is where
+# same-line content begins (-1 for a well-formed header like `|` or `|-2`),
+# or None if i is not a block header
+def _block_header(text, i, line_start):
+    key = _key_start(text, line_start)
+    k = i - 1
+    while k >= line_start and text[k] in " \t":
+        k -= 1
+    if k == i - 1 or k < line_start:
+        return None
+    if text[k] == "-":
+        if k >= key:
+            return None
+        owner = k - line_start
+    elif text[k] == ":":
+        # Must be the key's own separator, not a `: ` inside a value
+        name = text[key:k]
+        if k < key or '"' in name or "'" in name or ": " in name or ":\t" in name:
+            return None
+        owner = key - line_start
     else:
-        if d1 != d2:
-            changes.append((path, d1, d2))
-    return changes
+        return None
+
+    n = len(text)
+    m = i + 1
+    if m < n and text[m] in "-+":
+        m += 1
+    if m < n and text[m] in "123456789":
+        m += 1
+    if m < n and text[m] in "-+" and text[m - 1] not in "-+":
+        m += 1
+    if m < n and text[m] not in " \t\r\n":
+        # Not a header at all: everything after the indicator is content
+        return owner, i + 1
+
+    while m < n and text[m] in " \t":
+        m += 1
+    if m == n or text[m] in "\r\n#":
+        return owner, -1
+    return owner, m
+
+# Index just past the indentation and any leading `- ` list markers
+def _key_start(text, line_start):
+    c = line_start
+    while text[c:c + 1] == " ":
+        c += 1
+    while text[c:c + 2] == "- ":
+        c += 2
+        while text[c:c + 1] == " ":
+            c += 1
+    return c
+
+# Start of the first line from pos that is not blank and is indented no
+# deeper than owner, i.e. the end of a block scalar's body
+def _block_body_end(text, pos, owner):
+    n = len(text)
+    while pos < n:
+        eol = text.find("\n", pos)
+        if eol == -1:
+            eol = n
+        line = text[pos:eol]
+        body = line.lstrip(" ")
+        if body.strip() and len(line) - len(body) <= owner:
+            return pos
+        pos = eol + 1
+    return n
+
+# Only `|` headers with same-line content are rewritten; `>` headers are
+# still recognised so their bodies are skipped
+def _fix_block_scalars(text):
+    out = []
+    start = 0
+    bar = text.find("|")
+    gt = text.find(">")
+    while bar != -1 or gt != -1:
+        i = bar if gt == -1 or (bar != -1 and bar < gt) else gt
+        pos = i + 1
+        line_start = text.rfind("\n", 0, i) + 1
+        header = _block_header(text, i, line_start)
+        if header is not None:
+            owner, j = header
+            if j != -1 and text[i] == "|":
+                out.append(text[start:j])
+                out.append("\n" + " " * (_key_start(text, line_start) - line_start + 2))
+                start = j
+            eol = text.find("\n", i)
+            pos = len(text) if eol == -1 else _block_body_end(text, eol + 1, owner)
+        if bar != -1 and bar < pos:
+            bar = text.find("|", pos)
+        if gt != -1 and gt < pos:
+            gt = text.find(">", pos)
+    out.append(text[start:])
+    return "".join(out)
 
 # Preprocess YAML text to fix common parsing issues
 def preprocess_yaml_text(content):
@@ -53,42 +198,81 @@ def preprocess_yaml_text(content):
     content = re.sub(r'(:\s*")([^"]*?)"', lambda m: f'{m.group(1)}{m.group(2).replace("\"","\\\"")}"', content)
 
     # Fix block scalars missing indentation (models: |9200...)
-    content = re.sub(r'(\|\s*)([^\s])', lambda m: f'|\n  {m.group(2)}', content)
+    content = _fix_block_scalars(content)
 
     return content
 
+# Dump YAML with block style for multiline strings
+_MULTILINE_TRIGGERS = frozenset('\n"\'\\<>')
+
+def represent_multiline_str(dumper, data):
+    if not _MULTILINE_TRIGGERS.isdisjoint(data):
+        return dumper.represent_scalar("tag:yaml.org,2002:str", data, style="|")
+    return dumper.represent_scalar("tag:yaml.org,2002:str", data)
+
+# Write anchored/aliased subtrees out in full, as the pre-in-place versions did
+class NoAliasCSafeDumper(CSafeDumper):
+    def ignore_aliases(self, data):
+        return True
+
+NoAliasCSafeDumper.add_representer(str, represent_multiline_str)
+
+# JSON sidecar cache: skip files already prefixed with the same prefix/keys
+def _cache_path(filepath):
+    return filepath + ".prefixed.json"
+
+def _file_digest(filepath):
+    return hashlib.sha256(Path(filepath).read_bytes()).hexdigest()
+
+def _cache_is_fresh(filepath, prefix, keys_to_prefix):
+    # Compare against a hash of the YAML as we wrote it: mtimes alone are
+    # fooled by exports restored with `cp -p`, `tar x`, `rsync -a`, ...
+    try:
+        with open(_cache_path(filepath), "r", encoding="utf-8") as f:
+            cache = json.load(f)
+        if cache.get("prefix") != prefix or cache.get("keys") != sorted(keys_to_prefix):
+            return False
+        return cache.get("sha256") == _file_digest(filepath)
+    except (OSError, ValueError, AttributeError):
+        return False
+
+def _write_cache(filepath, prefix, keys_to_prefix):
+    with open(_cache_path(filepath), "w", encoding="utf-8") as f:
+        json.dump({"prefix": prefix, "keys": sorted(keys_to_prefix), "sha256": _file_digest(filepath)}, f)
+
 # Process a YAML file
-def process_yaml_file(filepath, prefix, keys_to_prefix, lookup):
+def process_yaml_file(filepath, prefix, keys_to_prefix):
+    # Runs in a worker process: returns (filename, lookup, diffs) for the
+    # parent to merge and report; diffs is None when the file was skipped
+    filename = os.path.basename(filepath)
+    lookup = {}
+    diffs = []
+    if _cache_is_fresh(filepath, prefix, keys_to_prefix):
+        return filename, lookup, None
+
     # Read and preprocess raw YAML text
-    with open(filepath, "r") as f:
-        raw_content = f.read()
+    raw_content = Path(filepath).read_text(encoding="utf-8")
     preprocessed_content = preprocess_yaml_text(raw_content)
 
     # Load YAML safely
-    original_data = yaml.safe_load(preprocessed_content)
+    data = yaml.load(preprocessed_content, Loader=CSafeLoader)
 
-    # Apply prefixing
-    updated_data = recursive_prefix_lookup(original_data, prefix, keys_to_prefix, lookup)
-    diffs = diff_dict(original_data, updated_data)
+    # Apply prefix in place; diffs are recorded during the same pass
+    prefix_inplace(data, prefix, keys_to_prefix, lookup, diffs)
 
     # Dump YAML with block style for multiline strings
-    def represent_multiline_str(dumper, data):
-        if "\n" in data or any(c in data for c in ['"', "'", "\\", "<", ">"]):
-            return dumper.represent_scalar("tag:yaml.org,2002:str", data, style="|")
-        return dumper.represent_scalar("tag:yaml.org,2002:str", data)
-
-    yaml.add_representer(str, represent_multiline_str)
+    # A wide line width stops the emitter from folding long values
+    with open(filepath, "wb", buffering=1024 * 1024) as f:
+        yaml.dump(data, f, Dumper=NoAliasCSafeDumper, sort_keys=False, allow_unicode=True, encoding="utf-8",
+                  default_flow_style=False, width=10_000)
+    _write_cache(filepath, prefix, keys_to_prefix)
 
-    with open(filepath, "w") as f:
-        yaml.safe_dump(updated_data, f, sort_keys=False, allow_unicode=True)
+    return filename, lookup, diffs
 
-    print(f"✅ Processed: {os.path.basename(filepath)}")
-    if diffs:
-        print("Changes made:")
-        for path, old, new in diffs:
-            print(f"  {path}: {old} -> {new}")
-    else:
-        print("No changes detected.")
+# Report strings
+CHANGES_HEADER = "Changes made:"
+NO_CHANGES = "No changes detected."
+LOOKUP_HEADER = "\nLookup table (old -> new values):\n"
 
 # Main entry point
 if __name__ == "__main__":
@@ -96,22 +280,42 @@ if __name__ == "__main__":
     lookup_table = {}
 
     file_key_map = {
-        "orgs.yaml": ["name"],
-        "projects.yaml": ["name", "organization"],
-        "teams.yaml": ["name", "organization"],
-        "schedules.yaml": ["name", "unified_job_template"],
-        "inventories.yaml": ["name", "organization"],
-        "job_templates.yaml": ["name", "organization", "project", "inventory", "credentials"],
-        "notification_templates.yaml": ["name", "organization"],
-        "workflow_job_templates.yaml": ["name", "organization", "workflow_job_template", "unified_job_template"],
+        "orgs.yaml": frozenset({"name"}),
+        "projects.yaml": frozenset({"name", "organization"}),
+        "teams.yaml": frozenset({"name", "organization"}),
+        "schedules.yaml": frozenset({"name", "unified_job_template"}),
+        "inventories.yaml": frozenset({"name", "organization"}),
+        "job_templates.yaml": frozenset({"name", "organization", "project", "inventory", "credentials"}),
+        "notification_templates.yaml": frozenset({"name", "organization"}),
+        "workflow_job_templates.yaml": frozenset({"name", "organization", "workflow_job_template", "unified_job_template"}),
     }
 
-    for filename, keys in file_key_map.items():
-        if os.path.exists(filename):
-            process_yaml_file(filename, prefix, keys, lookup_table)
-        else:
-            print(f"⚠️ Skipping {filename} (not found)")
+    # Files are independent, so parse/prefix/dump them in parallel
+    with ProcessPoolExecutor() as executor:
+        futures = {}
+        for filename, keys in file_key_map.items():
+            if os.path.exists(filename):
+                futures[executor.submit(process_yaml_file, filename, prefix, keys)] = filename
+            else:
+                print(f"⚠️ Skipping {filename} (not found)")
+
+        for future in as_completed(futures):
+            try:
+                filename, local_lookup, diffs = future.result()
+            except Exception as e:
+                sys.stdout.write(f"❌ Failed to process {futures[future]}: {e}\n")
+                continue
+            if diffs is None:
+                sys.stdout.write(f"✅ Skipping {filename} (up to date)\n")
+                continue
+            lookup_table.update(local_lookup)
+            # One write per file report instead of a print() per line
+            out = [f"✅ Processed: {filename}"]
+            if diffs:
+                out.append(CHANGES_HEADER)
+                out.extend(f"  {path}: {old} -> {new}" for path, old, new in diffs)
+            else:
+                out.append(NO_CHANGES)
+            sys.stdout.write("\n".join(out) + "\n")
 
-    print("\nLookup table (old -> new values):")
-    for old, new in lookup_table.items():
-        print(f"  {old} -> {new}")
+    sys.stdout.write(LOOKUP_HEADER + "".join(f"  {old} -> {new}\n" for old, new in lookup_table.items()))
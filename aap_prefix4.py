@@ -1,67 +1,259 @@
-import yaml
+import json
 import os
-import re
-
-# -----------------------------
-# Recursive prefix function with lookup
-# -----------------------------
-def recursive_prefix_lookup(data, prefix, keys_to_prefix, lookup):
-    if isinstance(data, dict):
-        new_data = {}
-        for key, value in data.items():
-            if key in keys_to_prefix and isinstance(value, str):
-                if not value.startswith(prefix):
-                    new_value = f"{prefix}{value}"
-                    lookup[value] = new_value
-                    new_data[key] = new_value
-                else:
-                    new_data[key] = value
-            else:
-                new_data[key] = recursive_prefix_lookup(value, prefix, keys_to_prefix, lookup)
-        return new_data
-    elif isinstance(data, list):
-        return [recursive_prefix_lookup(item, prefix, keys_to_prefix, lookup) for item in data]
-    else:
-        return data
-
-# -----------------------------
-# Diff function for reporting changes
-# -----------------------------
-def diff_dict(d1, d2, path=""):
-    changes = []
-    if isinstance(d1, dict) and isinstance(d2, dict):
-        for k in d1.keys() | d2.keys():
-            p = f"{path}.{k}" if path else k
-            if k in d1 and k in d2:
-                changes.extend(diff_dict(d1[k], d2[k], p))
-            elif k in d1:
-                changes.append((p, d1[k], None))
-            else:
-                changes.append((p, None, d2[k]))
-    elif isinstance(d1, list) and isinstance(d2, list):
-        for i, (v1, v2) in enumerate(zip(d1, d2)):
-            p = f"{path}[{i}]"
-            changes.extend(diff_dict(v1, v2, p))
-        for i in range(len(d1), len(d2)):
-            changes.append((f"{path}[{i}]", None, d2[i]))
-        for i in range(len(d2), len(d1)):
-            changes.append((f"{path}[{i}]", d1[i], None))
-    else:
-        if d1 != d2:
-            changes.append((path, d1, d2))
-    return changes
+import socket
+import struct
+import sys
+
+PROMPT = "Enter prefix to prepend (e.g., dev_): "
+
+# -----------------------------
+# Resident daemon: skips the yaml/process-pool imports and setup per run.
+# Messages are length-prefixed (!I) frames; the client sends one JSON
+# request {"prefix", "cwd"} and the daemon streams report text back,
+# ending with an empty frame.
+# -----------------------------
+SOCKET_PATH = os.path.expanduser("~/.cache/aap_append.sock")
+
+def _send_frame(sock, payload):
+    sock.sendall(struct.pack("!I", len(payload)) + payload)
+
+def _recv_exact(sock, size):
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = sock.recv(size - len(buf))
+        if not chunk:
+            raise ConnectionError("connection closed mid-frame")
+        buf += chunk
+    return bytes(buf)
+
+def _recv_frame(sock):
+    (size,) = struct.unpack("!I", _recv_exact(sock, 4))
+    return _recv_exact(sock, size)
+
+def client(prefix, socket_path=SOCKET_PATH):
+    # Returns False when no daemon is reachable so the caller can run locally
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+        except OSError:
+            return False
+        try:
+            _send_frame(sock, json.dumps({"prefix": prefix, "cwd": os.getcwd()}).encode("utf-8"))
+            while True:
+                chunk = _recv_frame(sock)
+                if not chunk:
+                    break
+                sys.stdout.write(chunk.decode("utf-8"))
+        except ConnectionError:
+            sys.exit("❌ Daemon closed the connection before finishing; check its output")
+    return True
+
+# A bare `--client` is served here, before yaml, argparse and the process
+# pool are imported, so talking to a running daemon stays cheap
+if __name__ == "__main__" and sys.argv[1:] == ["--client"]:
+    client_prefix = input(PROMPT).strip()
+    if client(client_prefix):
+        sys.exit(0)
+    print(f"⚠️ No daemon listening on {SOCKET_PATH}; running locally")
+
+import yaml
+import argparse
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+try:
+    from yaml import CSafeLoader, CSafeDumper
+except ImportError:
+    from yaml import SafeLoader as CSafeLoader, SafeDumper as CSafeDumper
+
+# -----------------------------
+# Prefix values in place (iteratively), recording lookup entries and diffs
+# -----------------------------
+# Paths are kept as linked (parent, key_or_index, is_index) tuples while
+# walking and only turned into "a.b[0].c" strings when a diff is recorded
+def _format_path(path):
+    parts = []
+    while path is not None:
+        path, part, is_index = path
+        parts.append(f"[{part}]" if is_index else f".{part}")
+    parts.reverse()
+    if parts and parts[0][0] == ".":
+        parts[0] = parts[0][1:]
+    return "".join(parts)
+
+# Stack marker pushed under a container's children; popping it closes
+# the range of diffs recorded beneath that container
+_SPAN_END = object()
+
+# Re-root a linked path recorded under old_base onto new_base
+def _rebase(path, old_base, new_base):
+    parts = []
+    while path is not old_base:
+        path, part, is_index = path
+        parts.append((part, is_index))
+    for part, is_index in reversed(parts):
+        new_base = (new_base, part, is_index)
+    return new_base
+
+def prefix_inplace(root, prefix, keys_to_prefix, lookup, diffs):
+    _str = str; _dict = dict; _list = list; _keys = keys_to_prefix; _intern = sys.intern
+    # A head-slice compare skips startswith()'s method-call overhead
+    prefix = _intern(prefix); plen = len(prefix)
+    # Containers shared via YAML anchors/aliases are walked once; every
+    # node stays alive through root, so id() values are not reused. The
+    # diffs found under a shared container are replayed for each later
+    # path that reaches it: spans maps its id to (path, start, end) over
+    # diff_paths, which holds the linked path of every diff recorded here
+    seen = set()
+    spans = {}
+    diff_paths = []
+    base = len(diffs)
+    stack = [(root, None)]
+    while stack:
+        node, path = stack.pop()
+        if node is _SPAN_END:
+            node_id, node_path, start = path
+            spans[node_id] = (node_path, start, len(diff_paths))
+            continue
+        node_id = id(node)
+        if node_id in seen:
+            # No span yet means a cycle back into a container still being walked
+            span = spans.get(node_id)
+            if span is not None:
+                old_path, start, end = span
+                for n in range(start, end):
+                    new_path = _rebase(diff_paths[n], old_path, path)
+                    _, value, new_value = diffs[base + n]
+                    diffs.append((_format_path(new_path), value, new_value))
+                    diff_paths.append(new_path)
+            continue
+        seen.add(node_id)
+        stack.append((_SPAN_END, (node_id, path, len(diff_paths))))
+        if type(node) is _dict:
+            children = []
+            for key, value in node.items():
+                if key in _keys and type(value) is _str:
+                    if value[:plen] != prefix:
+                        # Reuse (and intern) the prefixed string for repeated names
+                        new_value = lookup.get(value)
+                        if new_value is None:
+                            new_value = _intern(prefix + value)
+                            lookup[value] = new_value
+                        node[key] = new_value
+                        leaf_path = (path, key, False)
+                        diffs.append((_format_path(leaf_path), value, new_value))
+                        diff_paths.append(leaf_path)
+                elif type(value) in (_dict, _list):
+                    children.append((value, (path, key, False)))
+            # Push in reverse so diffs keep document order
+            stack.extend(reversed(children))
+        elif type(node) is _list:
+            children = [(item, (path, i, True)) for i, item in enumerate(node) if type(item) in (_dict, _list)]
+            stack.extend(reversed(children))
 
 # -----------------------------
 # Fix malformed block scalars
 # -----------------------------
+# e.g. `models: |9200` -> `models: |` + newline + indented `9200`.
+# A `|`/`>` only counts as a block header right after the line's own key
+# separator or a leading `- ` list marker. Well-formed headers such as `|`,
+# `|-` or `>+2` are left untouched, and block-scalar bodies are skipped so
+# indicators inside their text are never rewritten.
+def _key_start(text, line_start):
+    # Index just past the indentation and any leading `- ` list markers
+    c = line_start
+    while text[c:c + 1] == b" ":
+        c += 1
+    while text[c:c + 2] == b"- ":
+        c += 2
+        while text[c:c + 1] == b" ":
+            c += 1
+    return c
+
+def _block_header(text, i, line_start):
+    # For the indicator at i return (owner, content_start): the column the
+    # block body must be indented past, and where same-line content begins
+    # (-1 for a well-formed header). None if i is not a block header.
+    key = _key_start(text, line_start)
+    k = i - 1
+    while k >= line_start and text[k] in b" \t":
+        k -= 1
+    if k == i - 1 or k < line_start:
+        return None
+    sep = text[k:k + 1]
+    if sep == b"-":
+        if k >= key:
+            return None
+        owner = k - line_start
+    elif sep == b":":
+        # Must be the key's own separator, not a `: ` inside a value
+        name = text[key:k]
+        if k < key or b'"' in name or b"'" in name or b": " in name or b":\t" in name:
+            return None
+        owner = key - line_start
+    else:
+        return None
+
+    n = len(text)
+    m = i + 1
+    if m < n and text[m] in b"-+":
+        m += 1
+    if m < n and text[m] in b"123456789":
+        m += 1
+    if m < n and text[m] in b"-+" and text[m - 1] not in b"-+":
+        m += 1
+    if m < n and text[m] not in b" \t\r\n":
+        # Not a header at all: everything after the indicator is content
+        return owner, i + 1
+
+    while m < n and text[m] in b" \t":
+        m += 1
+    if m == n or text[m] in b"\r\n#":
+        return owner, -1
+    return owner, m
+
+def _block_body_end(text, pos, owner):
+    # Start of the first line from pos that is not blank and is indented
+    # no deeper than owner, i.e. the end of the block scalar's body
+    n = len(text)
+    while pos < n:
+        eol = text.find(b"\n", pos)
+        if eol == -1:
+            eol = n
+        line = text[pos:eol]
+        body = line.lstrip(b" ")
+        if body.strip() and len(line) - len(body) <= owner:
+            return pos
+        pos = eol + 1
+    return n
+
 def fix_block_scalars(text):
-    def repl(m):
-        return m.group(1) + "\n  " + m.group(2)
-    pattern = re.compile(r"(\|\s*)([^\n\s])")
-    text = pattern.sub(repl, text)
-    pattern2 = re.compile(r"(\>\s*)([^\n\s])")
-    text = pattern2.sub(repl, text)
-    return text
+    out = bytearray()
+    start = 0
+    bar = text.find(b"|")
+    gt = text.find(b">")
+    while bar != -1 or gt != -1:
+        i = bar if gt == -1 or (bar != -1 and bar < gt) else gt
+        pos = i + 1
+        line_start = text.rfind(b"\n", 0, i) + 1
+        header = _block_header(text, i, line_start)
+        if header is not None:
+            owner, j = header
+            if j != -1:
+                out += text[start:j]
+                out += b"\n" + b" " * (_key_start(text, line_start) - line_start + 2)
+                start = j
+            eol = text.find(b"\n", i)
+            pos = len(text) if eol == -1 else _block_body_end(text, eol + 1, owner)
+        if bar != -1 and bar < pos:
+            bar = text.find(b"|", pos)
+        if gt != -1 and gt < pos:
+            gt = text.find(b">", pos)
+    if not start:
+        return text
+    out += text[start:]
+    return bytes(out)
 
 # -----------------------------
 # Ignore unknown YAML tags like !unsafe
@@ -76,71 +268,199 @@ def ignore_unknown_tags(loader, tag_suffix, node):
     else:
         return None
 
-yaml.SafeLoader.add_multi_constructor('!', ignore_unknown_tags)
+CSafeLoader.add_multi_constructor('!', ignore_unknown_tags)
+
+# -----------------------------
+# Dump YAML with block style for multiline strings
+# -----------------------------
+_MULTILINE_TRIGGERS = frozenset('\n"\'\\<>')
+
+def represent_multiline_str(dumper, data):
+    if not _MULTILINE_TRIGGERS.isdisjoint(data):
+        return dumper.represent_scalar("tag:yaml.org,2002:str", data, style="|")
+    return dumper.represent_scalar("tag:yaml.org,2002:str", data)
+
+# Write anchored/aliased subtrees out in full, as the pre-in-place versions did
+class NoAliasCSafeDumper(CSafeDumper):
+    def ignore_aliases(self, data):
+        return True
+
+NoAliasCSafeDumper.add_representer(str, represent_multiline_str)
+
+# -----------------------------
+# JSON sidecar cache: skip files already prefixed with the same prefix/keys
+# -----------------------------
+def _cache_path(filepath):
+    return filepath + ".prefixed.json"
+
+def _file_digest(filepath):
+    return hashlib.sha256(Path(filepath).read_bytes()).hexdigest()
+
+def _cache_is_fresh(filepath, prefix, keys_to_prefix):
+    # Compare against a hash of the YAML as we wrote it: mtimes alone are
+    # fooled by exports restored with `cp -p`, `tar x`, `rsync -a`, ...
+    try:
+        with open(_cache_path(filepath), "r", encoding="utf-8") as f:
+            cache = json.load(f)
+        if cache.get("prefix") != prefix or cache.get("keys") != sorted(keys_to_prefix):
+            return False
+        return cache.get("sha256") == _file_digest(filepath)
+    except (OSError, ValueError, AttributeError):
+        return False
+
+def _write_cache(filepath, prefix, keys_to_prefix):
+    with open(_cache_path(filepath), "w", encoding="utf-8") as f:
+        json.dump({"prefix": prefix, "keys": sorted(keys_to_prefix), "sha256": _file_digest(filepath)}, f)
 
 # -----------------------------
 # Process a YAML file
 # -----------------------------
-def process_yaml_file(filepath, prefix, keys_to_prefix, lookup):
-    with open(filepath, "r") as f:
-        raw_content = f.read()
+def process_yaml_file(filepath, prefix, keys_to_prefix):
+    # Runs in a worker process: returns (filename, lookup, diffs) for the
+    # parent to merge and report; diffs is None when the file was skipped
+    filename = os.path.basename(filepath)
+    lookup = {}
+    diffs = []
+    if _cache_is_fresh(filepath, prefix, keys_to_prefix):
+        return filename, lookup, None
+
+    raw_content = Path(filepath).read_bytes()
 
     # Fix block scalar issues
     raw_content = fix_block_scalars(raw_content)
 
-    # Load YAML safely
-    original_data = yaml.safe_load(raw_content)
+    # Load YAML safely; libyaml decodes the bytes itself
+    data = yaml.load(raw_content, Loader=CSafeLoader)
 
-    # Apply prefix
-    updated_data = recursive_prefix_lookup(original_data, prefix, keys_to_prefix, lookup)
-    diffs = diff_dict(original_data, updated_data)
+    # Apply prefix in place; diffs are recorded during the same pass
+    prefix_inplace(data, prefix, keys_to_prefix, lookup, diffs)
 
     # Dump YAML with block style for multiline strings
-    def represent_multiline_str(dumper, data):
-        if "\n" in data or any(c in data for c in ['"', "'", "\\", "<", ">"]):
-            return dumper.represent_scalar("tag:yaml.org,2002:str", data, style="|")
-        return dumper.represent_scalar("tag:yaml.org,2002:str", data)
+    # A wide line width stops the emitter from folding long values
+    with open(filepath, "wb", buffering=1024 * 1024) as f:
+        yaml.dump(data, f, Dumper=NoAliasCSafeDumper, sort_keys=False, allow_unicode=True, encoding="utf-8",
+                  default_flow_style=False, width=10_000)
+    _write_cache(filepath, prefix, keys_to_prefix)
 
-    yaml.add_representer(str, represent_multiline_str)
+    return filename, lookup, diffs
 
-    with open(filepath, "w") as f:
-        yaml.safe_dump(updated_data, f, sort_keys=False, allow_unicode=True)
+# -----------------------------
+# Report strings
+# -----------------------------
+CHANGES_HEADER = "Changes made:"
+NO_CHANGES = "No changes detected."
+LOOKUP_HEADER = "\nLookup table (old -> new values):\n"
 
-    print(f"✅ Processed: {os.path.basename(filepath)}")
-    if diffs:
-        print("Changes made:")
-        for path, old, new in diffs:
-            print(f"  {path}: {old} -> {new}")
-    else:
-        print("No changes detected.")
+file_key_map = {
+    "orgs.yaml": frozenset({"name"}),
+    "projects.yaml": frozenset({"name", "organization"}),
+    "teams.yaml": frozenset({"name", "organization"}),
+    "schedules.yaml": frozenset({"name", "unified_job_template"}),
+    "inventories.yaml": frozenset({"name", "organization"}),
+    "job_templates.yaml": frozenset({"name", "organization", "project", "inventory", "credentials"}),
+    "notification_templates.yaml": frozenset({"name", "organization"}),
+    "workflow_job_templates.yaml": frozenset({"name", "organization", "workflow_job_template", "unified_job_template"}),
+}
 
 # -----------------------------
-# Main entry point
+# Prefix every known file in a directory, reporting through write()
 # -----------------------------
-if __name__ == "__main__":
-    prefix = input("Enter prefix to prepend (e.g., dev_): ").strip()
+def run(prefix, directory, write, executor):
     lookup_table = {}
 
-    file_key_map = {
-        "orgs.yaml": ["name"],
-        "projects.yaml": ["name", "organization"],
-        "teams.yaml": ["name", "organization"],
-        "schedules.yaml": ["name", "unified_job_template"],
-        "inventories.yaml": ["name", "organization"],
-        "job_templates.yaml": ["name", "organization", "project", "inventory", "credentials"],
-        "notification_templates.yaml": ["name", "organization"],
-        "workflow_job_templates.yaml": ["name", "organization", "workflow_job_template", "unified_job_template"],
-    }
-
+    # Files are independent, so parse/prefix/dump them in parallel
+    futures = {}
     for filename, keys in file_key_map.items():
-        if os.path.exists(filename):
-            try:
-                process_yaml_file(filename, prefix, keys, lookup_table)
-            except Exception as e:
-                print(f"❌ Failed to process {filename}: {e}")
+        filepath = os.path.join(directory, filename)
+        if os.path.exists(filepath):
+            futures[executor.submit(process_yaml_file, filepath, prefix, keys)] = filename
+        else:
+            write(f"⚠️ Skipping {filename} (not found)\n")
+
+    for future in as_completed(futures):
+        try:
+            filename, local_lookup, diffs = future.result()
+        except Exception as e:
+            write(f"❌ Failed to process {futures[future]}: {e}\n")
+            continue
+        if diffs is None:
+            write(f"✅ Skipping {filename} (up to date)\n")
+            continue
+        lookup_table.update(local_lookup)
+        # One write per file report instead of a print() per line
+        out = [f"✅ Processed: {filename}"]
+        if diffs:
+            out.append(CHANGES_HEADER)
+            out.extend(f"  {path}: {old} -> {new}" for path, old, new in diffs)
         else:
-            print(f"⚠️ Skipping {filename} (not found)")
+            out.append(NO_CHANGES)
+        write("\n".join(out) + "\n")
+
+    write(LOOKUP_HEADER + "".join(f"  {old} -> {new}\n" for old, new in lookup_table.items()))
+
+# -----------------------------
+# Resident daemon (protocol helpers and client are at the top of the file)
+# -----------------------------
+def _daemon_running(socket_path):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(socket_path)
+        except OSError:
+            return False
+    return True
+
+def serve(socket_path=SOCKET_PATH):
+    os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+    if os.path.exists(socket_path):
+        if _daemon_running(socket_path):
+            sys.exit(f"❌ A daemon is already listening on {socket_path}")
+        # Stale socket left behind by a daemon that was killed
+        os.unlink(socket_path)
 
-    print("\nLookup table (old -> new values):")
-    for old, new in lookup_table.items():
-        print(f"  {old} -> {new}")
+    with ProcessPoolExecutor() as executor, socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+        server.bind(socket_path)
+        os.chmod(socket_path, 0o600)
+        server.listen()
+        print(f"Listening on {socket_path}")
+        try:
+            while True:
+                conn, _ = server.accept()
+                with conn:
+                    try:
+                        request = json.loads(_recv_frame(conn))
+                        run(request["prefix"], request["cwd"],
+                            lambda text: _send_frame(conn, text.encode("utf-8")), executor)
+                        _send_frame(conn, b"")
+                    except ConnectionError:
+                        # Client went away (or was a _daemon_running() probe)
+                        continue
+                    except Exception as e:
+                        message = f"❌ Request failed: {e}"
+                        print(message)
+                        # Pass the reason on so the client doesn't just see a dropped connection
+                        try:
+                            _send_frame(conn, f"{message}\n".encode("utf-8"))
+                            _send_frame(conn, b"")
+                        except OSError:
+                            pass
+        finally:
+            os.unlink(socket_path)
+
+# -----------------------------
+# Main entry point
+# -----------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prepend a prefix to names in AAP export YAML files.")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--daemon", action="store_true", help=f"serve requests on {SOCKET_PATH}")
+    mode.add_argument("--client", action="store_true",
+                      help="hand the current directory to a running daemon (runs locally if none is up)")
+    args = parser.parse_args()
+
+    if args.daemon:
+        serve()
+    else:
+        # With --client we only get here when no daemon answered above
+        prefix = client_prefix if args.client else input(PROMPT).strip()
+        with ProcessPoolExecutor() as executor:
+            run(prefix, os.getcwd(), sys.stdout.write, executor)